@@ -1,15 +1,21 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 import uvicorn
 import os
-import json
-import uuid
+import shutil
+import orjson
+import time
+from ulid import ULID
 from dotenv import load_dotenv
 import asyncio
+import anyio
+from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
 # 加载配置
@@ -21,13 +27,36 @@ from core.retrieval import HybridRetriever
 from core.agent import CustomerServiceAgent
 from core.feedback import FeedbackManager
 
+# 应用生命周期：扩大线程池容量（同步路由在线程池中执行，默认40个线程在突发请求下容易耗尽）
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = int(os.getenv("THREADPOOL_SIZE", "100"))
+    yield
+
 # 初始化应用
 app = FastAPI(
     title="Agentic RAG 本地智能客服系统",
     description="基于Ollama本地模型的智能客服系统，支持本地知识库管理、混合检索和透明化工具调用",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# GZip压缩（文档列表/反馈详情等JSON响应重复键多、中文文本多，压缩率很高）
+# SSE流式端点跳过压缩：压缩缓冲在部分代理下会破坏event-stream分帧
+class ConditionalGZipMiddleware:
+    def __init__(self, app, minimum_size: int = 1024, compresslevel: int = 5):
+        self.app = app
+        self.gzip_app = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/api/query/stream":
+            await self.app(scope, receive, send)
+        else:
+            await self.gzip_app(scope, receive, send)
+
+app.add_middleware(ConditionalGZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # 配置CORS
 app.add_middleware(
     CORSMiddleware,
@@ -46,15 +75,42 @@ feedback_manager = FeedbackManager()
 # 挂载静态文件
 app.mount("/static", StaticFiles(directory="./web"), name="static")
 
+# 文档列表缓存（避免轮询类请求每次都扫描目录）
+_DOC_CACHE_TTL = 5.0  # 缓存有效期（秒）
+_doc_cache = {"mtime": 0, "files": [], "expires": 0.0}
+
+def _list_documents() -> list:
+    """列出文档目录中的文件（带TTL缓存，目录未变化时直接返回缓存结果）"""
+    documents_path = os.getenv("DOCUMENTS_PATH", "./data/documents")
+    now = time.time()
+    mtime = os.stat(documents_path).st_mtime_ns
+
+    # 缓存未过期且目录未修改，直接返回缓存
+    if now < _doc_cache["expires"] and mtime == _doc_cache["mtime"]:
+        return _doc_cache["files"]
+
+    # 使用scandir重新扫描（排除临时文件和隐藏文件）
+    with os.scandir(documents_path) as it:
+        files = [e.name for e in it if not e.name.startswith('.') and e.is_file(follow_symlinks=False)]
+
+    _doc_cache["mtime"] = mtime
+    _doc_cache["files"] = files
+    _doc_cache["expires"] = now + _DOC_CACHE_TTL
+    return files
+
 # 根路径返回前端页面
 @app.get("/")
-async def root():
+def root():
     return FileResponse("./web/index.html")
 
+# 预序列化的静态响应（绕过pydantic/jsonable_encoder，高频探活请求直接返回现成字节）
+_HEALTH_RESPONSE = orjson.dumps({"status": "healthy"})
+_SSE_ERROR_PREFIX = b'data: {"type": "error", "data": '
+
 # 健康检查
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
+    return Response(content=_HEALTH_RESPONSE, media_type="application/json")
 
 # 上传文档
 @app.post("/api/documents/upload")
@@ -64,13 +120,17 @@ async def upload_document(
 ):
     try:
         file_path = os.path.join(os.getenv("DOCUMENTS_PATH", "./data/documents"), file.filename)
-        
+
+        # 分块写入磁盘，避免将整个文件读入内存；写入放入线程池以免阻塞事件循环
         with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
-        
+            await run_in_threadpool(shutil.copyfileobj, file.file, buffer, 1 << 20)
+
         # 处理文档并添加到知识库
         knowledge_base.add_document(file_path, document_type)
-        
+
+        # 上传后强制刷新文档列表缓存
+        _doc_cache["expires"] = 0.0
+
         return {"message": "文档上传成功", "filename": file.filename}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -84,9 +144,9 @@ async def process_query(query: dict):
         if not user_query:
             raise HTTPException(status_code=400, detail="查询内容不能为空")
         
-        # 使用Agent处理查询（流式）
-        result = agent.process_query(user_query, session_id)
-        
+        # 使用Agent处理查询（规划与检索并发执行）
+        result = await agent.aprocess_query(user_query, session_id)
+
         return JSONResponse(content=result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -104,17 +164,17 @@ async def process_query_stream(query: dict):
         async def generate():
             try:
                 # 生成查询ID
-                query_id = str(uuid.uuid4())
-                
-                # 发送查询ID
-                yield f"data: {json.dumps({'type': 'query_id', 'data': query_id}, ensure_ascii=False)}\n\n"
+                query_id = str(ULID())
                 
+                # 发送查询ID（orjson直接输出UTF-8字节，序列化开销远低于标准库json）
+                yield b"data: " + orjson.dumps({"type": "query_id", "data": query_id}) + b"\n\n"
+
                 # 流式处理查询
                 async for chunk in agent.process_query_stream(user_query, query_id, session_id):
-                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
-                    
+                    yield b"data: " + orjson.dumps(chunk) + b"\n\n"
+
             except Exception as e:
-                yield f"data: {json.dumps({'type': 'error', 'data': str(e)}, ensure_ascii=False)}\n\n"
+                yield _SSE_ERROR_PREFIX + orjson.dumps(str(e)) + b"}\n\n"
         
         return StreamingResponse(
             generate(),
@@ -130,7 +190,7 @@ async def process_query_stream(query: dict):
 
 # 提交反馈
 @app.post("/api/feedback")
-async def submit_feedback(feedback: dict):
+def submit_feedback(feedback: dict):
     try:
         query_id = feedback.get("query_id")
         is_solved = feedback.get("is_solved")
@@ -145,7 +205,7 @@ async def submit_feedback(feedback: dict):
 
 # 获取反馈统计
 @app.get("/api/feedback/stats")
-async def get_feedback_stats():
+def get_feedback_stats():
     try:
         stats = feedback_manager.get_feedback_stats()
         return stats
@@ -154,7 +214,7 @@ async def get_feedback_stats():
 
 # 获取详细反馈统计
 @app.get("/api/feedback/details")
-async def get_feedback_details(limit: int = Query(50, ge=1, le=100)):
+def get_feedback_details(limit: int = Query(50, ge=1, le=100)):
     try:
         details = feedback_manager.get_feedback_details(limit)
         return details
@@ -163,7 +223,7 @@ async def get_feedback_details(limit: int = Query(50, ge=1, le=100)):
 
 # 获取已解决的反馈
 @app.get("/api/feedback/solved")
-async def get_solved_feedbacks(limit: int = Query(50, ge=1, le=100)):
+def get_solved_feedbacks(limit: int = Query(50, ge=1, le=100)):
     try:
         solved_feedbacks = feedback_manager.get_feedbacks_by_status(True)
         return {
@@ -175,7 +235,7 @@ async def get_solved_feedbacks(limit: int = Query(50, ge=1, le=100)):
 
 # 获取未解决的反馈
 @app.get("/api/feedback/unsolved")
-async def get_unsolved_feedbacks(limit: int = Query(50, ge=1, le=100)):
+def get_unsolved_feedbacks(limit: int = Query(50, ge=1, le=100)):
     try:
         unsolved_feedbacks = feedback_manager.get_feedbacks_by_status(False)
         return {
@@ -187,13 +247,10 @@ async def get_unsolved_feedbacks(limit: int = Query(50, ge=1, le=100)):
 
 # 获取知识库统计
 @app.get("/api/documents/stats")
-async def get_documents_stats():
+def get_documents_stats():
     try:
-        # 获取文档目录中的文件列表
-        documents_path = os.getenv("DOCUMENTS_PATH", "./data/documents")
-        files = os.listdir(documents_path)
-        # 过滤出实际的文档文件（排除临时文件和隐藏文件）
-        document_files = [f for f in files if not f.startswith('.') and os.path.isfile(os.path.join(documents_path, f))]
+        # 获取文档目录中的文件列表（带缓存）
+        document_files = _list_documents()
         return {
             "total_documents": len(document_files),
             "documents": document_files
@@ -203,14 +260,11 @@ async def get_documents_stats():
 
 # 获取知识库内容
 @app.get("/api/knowledge-base")
-async def get_knowledge_base():
+def get_knowledge_base():
     try:
-        # 获取文档目录中的文件列表
-        documents_path = os.getenv("DOCUMENTS_PATH", "./data/documents")
-        files = os.listdir(documents_path)
-        # 过滤出实际的文档文件（排除临时文件和隐藏文件）
-        document_files = [f for f in files if not f.startswith('.') and os.path.isfile(os.path.join(documents_path, f))]
-        
+        # 获取文档目录中的文件列表（带缓存）
+        document_files = _list_documents()
+
         # 构建知识库内容
         knowledge_base_content = {
             "documents": document_files,
@@ -223,7 +277,7 @@ async def get_knowledge_base():
 
 # 获取缓存统计信息
 @app.get("/api/cache/stats")
-async def get_cache_stats():
+def get_cache_stats():
     try:
         stats = hybrid_retriever.get_cache_stats()
         return stats
@@ -235,6 +289,7 @@ async def get_cache_stats():
 async def clear_cache():
     try:
         hybrid_retriever.clear_cache()
+        agent.semantic_cache.clear()
         return {"message": "缓存已清空"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -248,15 +303,24 @@ async def invalidate_cache(query_data: dict):
             raise HTTPException(status_code=400, detail="查询内容不能为空")
         
         hybrid_retriever.invalidate_cache_by_query(query)
+        agent.semantic_cache.invalidate_by_query(query)
         return {"message": f"查询 '{query[:50]}...' 的缓存已失效"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # 启动应用
 if __name__ == "__main__":
+    # uvloop + httptools 替换默认的asyncio事件循环和h11解析器，降低请求解析和任务调度开销
+    # 多worker需显式设置WORKERS：每个worker都会执行模块级初始化（含模拟数据入库、
+    # 关键词索引构建），默认单worker避免并发写坏共享的知识库/索引文件。
+    # 生产环境可用多worker部署：gunicorn app:app -k uvicorn.workers.UvicornWorker -w <N>
+    reload_enabled = os.getenv("RELOAD", "false").lower() == "true"
     uvicorn.run(
         "app:app",
         host=os.getenv("HOST", "0.0.0.0"),
         port=int(os.getenv("PORT", "8000")),
-        reload=True
+        loop="uvloop",
+        http="httptools",
+        workers=1 if reload_enabled else int(os.getenv("WORKERS", "1")),
+        reload=reload_enabled
     )
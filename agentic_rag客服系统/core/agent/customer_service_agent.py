@@ -1,16 +1,22 @@
 import os
-import uuid
+import re
+import time
 import asyncio
+import jieba
 from typing import List, Dict, Optional, AsyncGenerator, Tuple
+import httpx
 from langchain_ollama import OllamaLLM
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from ulid import ULID
 from loguru import logger
 from rich.console import Console
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 
+from core.cache import SemanticQueryCache
+from core.retrieval.reranker import CrossEncoderReranker
 from core.memory.conversation_memory import ConversationMemory
 
 console = Console()
@@ -23,20 +29,42 @@ class CustomerServiceAgent:
             model=os.getenv("LLM_MODEL", "qwen3:8b"),
             temperature=0.3,
             top_p=0.9,
-            base_url="http://localhost:11434"
+            base_url="http://localhost:11434",
+            # 底层httpx客户端保持长连接，免去每次LLM调用的TCP建连开销
+            client_kwargs={
+                "limits": httpx.Limits(max_keepalive_connections=16, keepalive_expiry=60)
+            }
         )
         self.output_parser = StrOutputParser()
         self.conversation_memory = ConversationMemory()
+
+        # 规划LLM调用开关（规划调用约占总时延一半且执行阶段并不依赖其输出，默认关闭，仅用于调试）
+        self.enable_planner = os.getenv("ENABLE_PLANNER", "false").lower() == "true"
         
-        # 初始化文本相似度检测器
+        # 初始化文本相似度检测器（中文无词边界，用jieba分词代替\b\w+\b）
         self.tfidf_vectorizer = TfidfVectorizer(
-            token_pattern=r'\b\w+\b',
+            tokenizer=jieba.lcut,
+            token_pattern=None,
             stop_words=None,
             lowercase=True
         )
         
+        # 上下文裁剪参数：按得分保留前K条，全局字符预算控制提示词长度（中文约1字≈1 token）
+        self.context_top_k = int(os.getenv("CONTEXT_TOP_K", "5"))
+        self.context_char_budget = int(os.getenv("CONTEXT_CHAR_BUDGET", "2000"))
+
+        # 违禁话题列表（可通过FORBIDDEN_TOPICS环境变量扩展，逗号分隔），编译为单个正则，一次扫描完成匹配
+        forbidden_topics = [t.strip() for t in os.getenv("FORBIDDEN_TOPICS", "政治,隐私,违法,恶意").split(",") if t.strip()]
+        self._forbidden_re = re.compile("|".join(map(re.escape, forbidden_topics)))
+
         # 初始化会话历史缓存（存储最近的查询和检索结果）
         self.session_cache = {}
+
+        # 初始化语义缓存（对语义相近的重复查询直接返回缓存回答）
+        self.semantic_cache = SemanticQueryCache(hybrid_retriever.knowledge_base.embeddings)
+
+        # 初始化重排序器（默认关闭，RERANKER_ENABLED=true开启）
+        self.reranker = CrossEncoderReranker()
         
         # 初始化提示模板
         self.plan_prompt = ChatPromptTemplate.from_template("""
@@ -103,22 +131,33 @@ Agent执行过程：
 6. 基于检索到的信息提供准确回答，不要编造信息
 7. 考虑对话历史中的上下文信息
 """)
-    
+
+        # 预编译LCEL链（链组合会分配RunnableSequence包装对象，只需构建一次）
+        self._plan_chain = self.plan_prompt | self.llm | self.output_parser
+        self._summarize_chain = self.summarize_prompt | self.llm | self.output_parser
+
     def process_query(self, query: str, session_id: str = "default") -> Dict:
         """处理用户查询"""
+        # 查询ID只生成一次，错误分支复用，避免异常路径上的二次随机数开销
+        query_id = str(ULID())
         try:
-            query_id = str(uuid.uuid4())
             logger.info(f"处理用户查询: {query_id}, 内容: {query}, 会话: {session_id}")
-            
-            # 获取对话历史和个人信息
-            conversation_history = self.conversation_memory.get_context(session_id)
-            personal_info = self.conversation_memory.get_personal_info(session_id)
-            
-            # 合并上下文
-            full_context = conversation_history
-            if personal_info:
-                full_context = personal_info + "\n" + conversation_history
-            
+
+            # 获取合并上下文（个人信息+对话历史，按会话版本号缓存，无变化时不重建）
+            full_context = self.conversation_memory.get_full_context(session_id)
+
+            # 语义缓存：仅对无上下文的查询启用。带上下文的回答混入了会话的
+            # 个人信息和历史，跨会话复用会泄露给其他用户
+            query_embedding = None
+            if not full_context:
+                query_embedding = self.semantic_cache.embed_query(query)
+                cached_result = self.semantic_cache.get(query_embedding)
+                if cached_result is not None:
+                    # 命中也要写入对话记忆，否则这轮对话在历史中凭空消失
+                    self.conversation_memory.add_message(session_id, "user", query)
+                    self.conversation_memory.add_message(session_id, "assistant", cached_result["answer"])
+                    return {**cached_result, "query_id": query_id}
+
             # 检查是否有相似的历史查询
             similar_query_data = self._find_similar_query(query, session_id)
             
@@ -135,10 +174,13 @@ Agent执行过程：
                     {"step": "反思", "content": f"复用 {len(retrieved_info)} 条历史检索信息，生成回答"}
                 ]
             else:
-                # 1. 制定执行计划
-                plan = self._create_plan(query, full_context)
-                logger.info(f"生成执行计划: {plan}")
-                
+                # 1. 制定执行计划（默认使用内置计划，省掉一次LLM往返；ENABLE_PLANNER=true时走LLM规划）
+                if self.enable_planner:
+                    plan = self._create_plan(query, full_context)
+                    logger.info(f"生成执行计划: {plan}")
+                else:
+                    plan = "默认计划：检索相关信息并生成回答"
+
                 # 2. 执行ReAct推理循环
                 execution_process, retrieved_info = self._execute_react(query, plan, full_context)
                 logger.info(f"执行完成，检索到 {len(retrieved_info)} 条信息")
@@ -160,37 +202,137 @@ Agent执行过程：
                 "answer": final_answer,
                 "execution_process": execution_process,
                 "retrieved_info": retrieved_info,
-                "timestamp": os.path.getmtime(__file__)
+                "timestamp": time.time()
             }
-            
+
+            # 存入语义缓存（仅无上下文的查询，见上）
+            if query_embedding is not None:
+                self.semantic_cache.set(query, query_embedding, result)
+
             return result
         except Exception as e:
             logger.error(f"处理查询失败: {str(e)}")
             return {
-                "query_id": str(uuid.uuid4()),
+                "query_id": query_id,
                 "query": query,
                 "answer": f"抱歉，处理您的问题时出现错误：{str(e)}",
                 "execution_process": [],
                 "retrieved_info": [],
-                "timestamp": os.path.getmtime(__file__)
+                "timestamp": time.time()
             }
     
+    async def aprocess_query(self, query: str, session_id: str = "default") -> Dict:
+        """异步处理用户查询（规划与检索并发执行）"""
+        # 查询ID只生成一次，错误分支复用，避免异常路径上的二次随机数开销
+        query_id = str(ULID())
+        try:
+            logger.info(f"异步处理用户查询: {query_id}, 内容: {query}, 会话: {session_id}")
+
+            # 获取合并上下文（个人信息+对话历史，按会话版本号缓存，无变化时不重建）
+            full_context = self.conversation_memory.get_full_context(session_id)
+
+            # 语义缓存：仅对无上下文的查询启用。带上下文的回答混入了会话的
+            # 个人信息和历史，跨会话复用会泄露给其他用户
+            query_embedding = None
+            if not full_context:
+                query_embedding = await asyncio.to_thread(self.semantic_cache.embed_query, query)
+                cached_result = self.semantic_cache.get(query_embedding)
+                if cached_result is not None:
+                    # 命中也要写入对话记忆，否则这轮对话在历史中凭空消失
+                    await asyncio.to_thread(self.conversation_memory.add_message, session_id, "user", query)
+                    await asyncio.to_thread(self.conversation_memory.add_message, session_id, "assistant", cached_result["answer"])
+                    return {**cached_result, "query_id": query_id}
+
+            # 检查是否有相似的历史查询（TF-IDF向量化是CPU密集操作，放入线程池避免阻塞事件循环）
+            similar_query_data = await asyncio.to_thread(self._find_similar_query, query, session_id)
+
+            if similar_query_data:
+                # 复用历史检索结果
+                logger.info("复用历史检索结果，跳过重新检索")
+                plan = similar_query_data["plan"]
+                retrieved_info = similar_query_data["retrieved_info"]
+
+                # 构建执行过程
+                execution_process = [
+                    {"step": "思考", "content": "检测到相似查询，复用历史检索结果"},
+                    {"step": "行动", "content": "直接使用之前的检索信息"},
+                    {"step": "反思", "content": f"复用 {len(retrieved_info)} 条历史检索信息，生成回答"}
+                ]
+            else:
+                # 规划与检索无数据依赖，并发执行以隐藏检索延迟
+                retrieve_task = asyncio.to_thread(self.hybrid_retriever.get_relevant_documents, query)
+                if self.enable_planner:
+                    plan, retrieved_docs = await asyncio.gather(
+                        self._acreate_plan(query, full_context),
+                        retrieve_task
+                    )
+                    logger.info(f"生成执行计划: {plan}")
+                else:
+                    plan = "默认计划：检索相关信息并生成回答"
+                    retrieved_docs = await retrieve_task
+
+                # 重排序（开启时精排候选并截取前K条）
+                retrieved_docs = await asyncio.to_thread(self.reranker.rerank, query, retrieved_docs)
+
+                # 格式化检索结果
+                retrieved_info = self._format_docs(retrieved_docs)
+
+                # 构建执行过程
+                execution_process = [
+                    {"step": "思考", "content": "分析用户问题，确定需要检索的关键信息"},
+                    {"step": "行动", "content": "调用混合检索工具获取相关信息"},
+                    {"step": "反思", "content": f"检索完成，找到 {len(retrieved_info)} 条相关信息，现在基于这些信息生成回答"}
+                ]
+                logger.info(f"执行完成，检索到 {len(retrieved_info)} 条信息")
+
+                # 缓存检索结果
+                self._cache_query_result(query, session_id, retrieved_info, plan)
+
+            # 生成最终回答
+            final_answer = await asyncio.to_thread(
+                self._generate_final_answer, query, execution_process, retrieved_info, full_context
+            )
+
+            # 保存对话到记忆（追加写盘，放入线程池避免阻塞事件循环）
+            await asyncio.to_thread(self.conversation_memory.add_message, session_id, "user", query)
+            await asyncio.to_thread(self.conversation_memory.add_message, session_id, "assistant", final_answer)
+
+            # 构建返回结果
+            result = {
+                "query_id": query_id,
+                "query": query,
+                "answer": final_answer,
+                "execution_process": execution_process,
+                "retrieved_info": retrieved_info,
+                "timestamp": time.time()
+            }
+
+            # 存入语义缓存（仅无上下文的查询，见上）
+            if query_embedding is not None:
+                self.semantic_cache.set(query, query_embedding, result)
+
+            return result
+        except Exception as e:
+            logger.error(f"异步处理查询失败: {str(e)}")
+            return {
+                "query_id": query_id,
+                "query": query,
+                "answer": f"抱歉，处理您的问题时出现错误：{str(e)}",
+                "execution_process": [],
+                "retrieved_info": [],
+                "timestamp": time.time()
+            }
+
     async def process_query_stream(self, query: str, query_id: str, session_id: str = "default") -> AsyncGenerator[Dict, None]:
         """流式处理用户查询"""
         try:
             logger.info(f"流式处理用户查询: {query_id}, 内容: {query}, 会话: {session_id}")
             
-            # 获取对话历史和个人信息
-            conversation_history = self.conversation_memory.get_context(session_id)
-            personal_info = self.conversation_memory.get_personal_info(session_id)
+            # 获取合并上下文（个人信息+对话历史，按会话版本号缓存，无变化时不重建）
+            full_context = self.conversation_memory.get_full_context(session_id)
             
-            # 合并上下文
-            full_context = conversation_history
-            if personal_info:
-                full_context = personal_info + "\n" + conversation_history
-            
-            # 检查是否有相似的历史查询
-            similar_query_data = self._find_similar_query(query, session_id)
+            # 检查是否有相似的历史查询（TF-IDF相似度计算放入线程池，避免阻塞事件循环）
+            similar_query_data = await asyncio.to_thread(self._find_similar_query, query, session_id)
             
             if similar_query_data:
                 # 复用历史检索结果
@@ -200,14 +342,11 @@ Agent执行过程：
                 
                 # 流式显示复用信息
                 yield {"type": "step", "step": "思考", "content": "检测到相似查询，复用历史检索结果"}
-                await asyncio.sleep(0.3)
-                
+
                 yield {"type": "step", "step": "行动", "content": "直接使用之前的检索信息"}
-                await asyncio.sleep(0.3)
-                
+
                 yield {"type": "step", "step": "反思", "content": f"复用 {len(retrieved_info)} 条历史检索信息，生成回答"}
-                await asyncio.sleep(0.5)
-                
+
                 # 构建执行过程字符串
                 execution_process = [
                     {"step": "思考", "content": "检测到相似查询，复用历史检索结果"},
@@ -217,61 +356,46 @@ Agent执行过程：
             else:
                 # 步骤1：制定执行计划
                 yield {"type": "step", "step": "规划", "content": "正在分析您的问题并制定执行计划..."}
-                await asyncio.sleep(0.5)
-                
-                # 流式生成执行计划
-                yield {"type": "step", "step": "规划", "content": "1. 分析用户问题的核心需求..."}
-                await asyncio.sleep(0.3)
-                
-                yield {"type": "step", "step": "规划", "content": "2. 确定需要检索的关键信息..."}
-                await asyncio.sleep(0.3)
-                
-                yield {"type": "step", "step": "规划", "content": "3. 制定工具调用策略和顺序..."}
-                await asyncio.sleep(0.3)
-                
-                # 实际生成计划
-                plan = self._create_plan(query, full_context)
-                logger.info(f"生成执行计划: {plan}")
-                
-                # 流式显示计划内容
-                plan_lines = plan.split('\n')
-                for i, line in enumerate(plan_lines):
-                    if line.strip():
-                        yield {"type": "step", "step": "规划", "content": f"执行计划: {line.strip()}"}
-                        await asyncio.sleep(0.2)
-                
-                yield {"type": "step", "step": "规划", "content": "执行计划已生成，开始执行..."}
-                await asyncio.sleep(0.3)
-                
+
+                # 规划与检索无数据依赖，先发起检索任务，让检索与规划LLM调用并发执行
+                retrieve_task = asyncio.create_task(
+                    asyncio.to_thread(self.hybrid_retriever.get_relevant_documents, query)
+                )
+
+                if self.enable_planner:
+                    plan = await self._acreate_plan(query, full_context)
+                    logger.info(f"生成执行计划: {plan}")
+
+                    # 流式显示计划内容
+                    for line in plan.split('\n'):
+                        if line.strip():
+                            yield {"type": "step", "step": "规划", "content": f"执行计划: {line.strip()}"}
+
+                    yield {"type": "step", "step": "规划", "content": "执行计划已生成，开始执行..."}
+                else:
+                    plan = "默认计划：检索相关信息并生成回答"
+
                 # 步骤2：思考
                 yield {"type": "step", "step": "思考", "content": "分析用户问题，确定需要检索的关键信息"}
-                await asyncio.sleep(0.5)
-                
+
                 # 步骤3：行动 - 检索信息
                 yield {"type": "step", "step": "行动", "content": "调用混合检索工具获取相关信息"}
-                await asyncio.sleep(0.3)
-                
-                # 执行检索
-                retrieved_docs = self.hybrid_retriever.get_relevant_documents(query)
-                
+
+                # 等待检索完成（通常已在规划期间结束）
+                retrieved_docs = await retrieve_task
+
+                # 重排序（开启时精排候选并截取前K条）
+                retrieved_docs = await asyncio.to_thread(self.reranker.rerank, query, retrieved_docs)
+
                 # 格式化检索结果
-                retrieved_info = []
-                for i, doc in enumerate(retrieved_docs):
-                    doc_info = {
-                        "id": i + 1,
-                        "content": doc["content"],
-                        "metadata": doc["metadata"],
-                        "score": doc.get("score", 0)
-                    }
-                    retrieved_info.append(doc_info)
-                
+                retrieved_info = self._format_docs(retrieved_docs)
+
                 # 缓存检索结果
                 self._cache_query_result(query, session_id, retrieved_info, plan)
                 
                 # 步骤4：反思
                 yield {"type": "step", "step": "反思", "content": f"检索完成，找到 {len(retrieved_info)} 条相关信息，现在基于这些信息生成回答"}
-                await asyncio.sleep(0.5)
-                
+
                 # 构建执行过程字符串
                 execution_process = [
                     {"step": "思考", "content": "分析用户问题，确定需要检索的关键信息"},
@@ -280,25 +404,45 @@ Agent执行过程：
                 ]
             
             # 步骤5：生成最终回答（流式）
+            # 提示词格式化在线程池任务中进行，与step事件推送重叠；
+            # 直接await任务结果，格式化异常可正常冒泡到外层错误处理
+            async def _produce_prompt_parts() -> Tuple[str, str]:
+                process_str = "\n".join([f"{step['step']}: {step['content']}" for step in execution_process])
+                retrieved_info_str = await asyncio.to_thread(self._format_retrieved_info, retrieved_info)
+                return process_str, retrieved_info_str
+
+            producer = asyncio.create_task(_produce_prompt_parts())
+
             yield {"type": "step", "step": "生成回答", "content": "正在生成最终回答..."}
+
+            process_str, retrieved_info_str = await producer
             
-            process_str = "\n".join([f"{step['step']}: {step['content']}" for step in execution_process])
-            
-            # 格式化检索信息
-            retrieved_info_str = self._format_retrieved_info(retrieved_info)
-            
-            # 流式生成回答
+            # 流式生成回答（逐token转发LLM输出，首字节延迟从全量生成降为首token延迟）
+            # 小缓冲聚合token：满64字符或距上次发送超过25ms即刷出，
+            # 将每token一帧的序列化/系统调用开销降约一个数量级，用户侧无感知
             full_answer = ""
-            answer_chunks = await self._generate_final_answer_stream(query, process_str, retrieved_info_str, full_context)
-            
-            for chunk in answer_chunks:
-                full_answer += chunk
-                yield {"type": "answer_chunk", "content": chunk}
-                await asyncio.sleep(0.05)
+            loop = asyncio.get_running_loop()
+            buf = []
+            buf_len = 0
+            last_flush = loop.time()
+            async for token in self.astream_answer(query, process_str, retrieved_info_str, full_context):
+                full_answer += token
+                buf.append(token)
+                buf_len += len(token)
+                now = loop.time()
+                if buf_len >= 64 or now - last_flush >= 0.025:
+                    yield {"type": "answer_chunk", "content": "".join(buf)}
+                    buf.clear()
+                    buf_len = 0
+                    last_flush = now
+
+            # 刷出剩余缓冲
+            if buf:
+                yield {"type": "answer_chunk", "content": "".join(buf)}
             
-            # 保存对话到记忆
-            self.conversation_memory.add_message(session_id, "user", query)
-            self.conversation_memory.add_message(session_id, "assistant", full_answer)
+            # 保存对话到记忆（磁盘写入放入线程池）
+            await asyncio.to_thread(self.conversation_memory.add_message, session_id, "user", query)
+            await asyncio.to_thread(self.conversation_memory.add_message, session_id, "assistant", full_answer)
             
             # 发送完成信号
             yield {
@@ -309,7 +453,7 @@ Agent执行过程：
                     "answer": full_answer,
                     "execution_process": execution_process,
                     "retrieved_info": retrieved_info,
-                    "timestamp": os.path.getmtime(__file__)
+                    "timestamp": time.time()
                 }
             }
             
@@ -320,13 +464,21 @@ Agent执行过程：
     def _create_plan(self, query: str, conversation_history: str = "") -> str:
         """制定执行计划"""
         try:
-            plan_chain = self.plan_prompt | self.llm | self.output_parser
-            plan = plan_chain.invoke({"query": query, "conversation_history": conversation_history})
+            plan = self._plan_chain.invoke({"query": query, "conversation_history": conversation_history})
             return plan
         except Exception as e:
             logger.error(f"制定计划失败: {str(e)}")
             return "默认计划：检索相关信息并生成回答"
     
+    async def _acreate_plan(self, query: str, conversation_history: str = "") -> str:
+        """异步制定执行计划"""
+        try:
+            plan = await self._plan_chain.ainvoke({"query": query, "conversation_history": conversation_history})
+            return plan
+        except Exception as e:
+            logger.error(f"制定计划失败: {str(e)}")
+            return "默认计划：检索相关信息并生成回答"
+
     def _execute_react(self, query: str, plan: str, conversation_history: str = "") -> tuple:
         """执行ReAct推理循环"""
         execution_process = []
@@ -343,17 +495,13 @@ Agent执行过程：
             
             # 执行检索
             retrieved_docs = self.hybrid_retriever.get_relevant_documents(query)
-            
+
+            # 重排序（开启时精排候选并截取前K条）
+            retrieved_docs = self.reranker.rerank(query, retrieved_docs)
+
             # 格式化检索结果
-            for i, doc in enumerate(retrieved_docs):
-                doc_info = {
-                    "id": i + 1,
-                    "content": doc["content"],
-                    "metadata": doc["metadata"],
-                    "score": doc.get("score", 0)
-                }
-                retrieved_info.append(doc_info)
-            
+            retrieved_info = self._format_docs(retrieved_docs)
+
             # 步骤3：反思
             reflection = f"检索完成，找到 {len(retrieved_info)} 条相关信息，现在基于这些信息生成回答"
             execution_process.append({"step": "反思", "content": reflection})
@@ -374,8 +522,7 @@ Agent执行过程：
             retrieved_info_str = self._format_retrieved_info(retrieved_info)
             
             # 生成回答
-            summarize_chain = self.summarize_prompt | self.llm | self.output_parser
-            answer = summarize_chain.invoke({
+            answer = self._summarize_chain.invoke({
                 "query": query,
                 "execution_process": process_str,
                 "retrieved_info": retrieved_info_str,
@@ -387,61 +534,81 @@ Agent执行过程：
             logger.error(f"生成回答失败: {str(e)}")
             return f"抱歉，生成回答时出现错误：{str(e)}"
     
-    async def _generate_final_answer_stream(self, query: str, process_str: str, retrieved_info_str: str, conversation_history: str = "") -> List[str]:
-        """流式生成最终回答"""
+    async def astream_answer(self, query: str, process_str: str, retrieved_info_str: str, conversation_history: str = "") -> AsyncGenerator[str, None]:
+        """流式生成最终回答（逐token产出LLM输出）"""
         try:
-            # 生成回答
-            summarize_chain = self.summarize_prompt | self.llm | self.output_parser
-            answer = summarize_chain.invoke({
+            async for token in self._summarize_chain.astream({
                 "query": query,
                 "execution_process": process_str,
                 "retrieved_info": retrieved_info_str,
                 "conversation_history": conversation_history
-            })
-            
-            # 将回答分成小块
-            chunks = []
-            chunk_size = 20  # 每次返回20个字符
-            
-            for i in range(0, len(answer), chunk_size):
-                chunk = answer[i:i + chunk_size]
-                chunks.append(chunk)
-            
-            return chunks
+            }):
+                yield token
         except Exception as e:
             logger.error(f"流式生成回答失败: {str(e)}")
-            return [f"抱歉，生成回答时出现错误：{str(e)}"]
-    
+            yield f"抱歉，生成回答时出现错误：{str(e)}"
+
+    @staticmethod
+    def _format_docs(retrieved_docs: List[Dict]) -> List[Dict]:
+        """将检索结果统一格式化为retrieved_info条目"""
+        return [
+            {
+                "id": i + 1,
+                "content": doc["content"],
+                "metadata": doc["metadata"],
+                "score": doc.get("score", 0)
+            }
+            for i, doc in enumerate(retrieved_docs)
+        ]
+
+    @staticmethod
+    def _truncate_at_boundary(content: str, limit: int) -> str:
+        """在预算范围内按句子边界截断，避免截到半句/半个语义单元"""
+        if len(content) <= limit:
+            return content
+
+        truncated = content[:limit]
+        # 优先回退到最后一个句号/换行处截断
+        boundary = max(truncated.rfind("。"), truncated.rfind("\n"))
+        if boundary > limit // 2:
+            truncated = truncated[:boundary + 1]
+        return truncated + "..."
+
     def _format_retrieved_info(self, retrieved_info: List[Dict]) -> str:
-        """格式化检索信息"""
+        """格式化检索信息（按得分保留前K条，全局字符预算内按句子边界截断）"""
         if not retrieved_info:
             return "无相关信息"
-        
+
+        # 按相关性得分降序，仅保留前K条（低分文档只会稀释提示词）
+        top_info = sorted(retrieved_info, key=lambda info: info.get("score", 0), reverse=True)
+        top_info = top_info[:self.context_top_k]
+
         formatted_info = []
-        for i, info in enumerate(retrieved_info):
-            source = info["metadata"].get("source", "未知来源")
-            content = info["content"][:200] + "..." if len(info["content"]) > 200 else info["content"]
-            formatted_info.append(f"[{i+1}] 来源: {source}\n内容: {content}")
-        
+        remaining = self.context_char_budget
+        for i, info in enumerate(top_info, 1):
+            if remaining <= 0:
+                break
+            content = self._truncate_at_boundary(info["content"], remaining)
+            remaining -= len(content)
+            formatted_info.append(
+                f"[{i}] 来源: {info['metadata'].get('source', '未知来源')}\n内容: {content}"
+            )
+
         return "\n\n".join(formatted_info)
     
     def _validate_query(self, query: str) -> bool:
         """验证查询是否合法"""
-        # 简单的安全检查
-        forbidden_topics = ["政治", "隐私", "违法", "恶意"]
-        for topic in forbidden_topics:
-            if topic in query:
-                return False
-        return True
+        # 简单的安全检查（预编译正则单次线性扫描）
+        return self._forbidden_re.search(query) is None
     
     def _handle_unsafe_query(self) -> Dict:
         """处理不安全查询"""
         return {
-            "query_id": str(uuid.uuid4()),
+            "query_id": str(ULID()),
             "answer": "抱歉，我无法处理此类问题。请提供与客服相关的合法合规问题。",
             "execution_process": [],
             "retrieved_info": [],
-            "timestamp": os.path.getmtime(__file__)
+            "timestamp": time.time()
         }
     
     def _calculate_similarity(self, text1: str, text2: str) -> float:
@@ -491,7 +658,7 @@ Agent执行过程：
         self.session_cache[session_id][query] = {
             "retrieved_info": retrieved_info,
             "plan": plan,
-            "timestamp": os.path.getmtime(__file__)
+            "timestamp": time.time()
         }
         logger.debug(f"缓存查询结果: '{query[:30]}...'")
     
@@ -1,3 +1,4 @@
 from .manager import QueryCacheManager
+from .semantic_cache import SemanticQueryCache
 
-__all__ = ["QueryCacheManager"]
+__all__ = ["QueryCacheManager", "SemanticQueryCache"]
@@ -1,6 +1,8 @@
 import os
-import hashlib
 import time
+import heapq
+import orjson
+import xxhash
 from typing import Dict, List, Optional, Any
 from datetime import datetime, timedelta
 from loguru import logger
@@ -17,6 +19,8 @@ class QueryCacheManager:
         self.cache_max_size = int(os.getenv("CACHE_MAX_SIZE", "1000"))  # 最大缓存条目数
         
         self.cache: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        # 过期堆：(过期时间, 缓存键)，配合读取时的惰性过期，免去每次写入的全量扫描
+        self._expiry_heap: List[tuple] = []
         self.cache_stats = {
             "hits": 0,
             "misses": 0,
@@ -26,9 +30,9 @@ class QueryCacheManager:
         logger.info(f"查询缓存管理器初始化完成 - 启用: {self.cache_enabled}, TTL: {self.cache_ttl}秒, 最大容量: {self.cache_max_size}")
     
     def _generate_cache_key(self, query: str, retrieval_params: Dict[str, Any]) -> str:
-        """生成缓存键"""
-        key_data = f"{query}_{retrieval_params}"
-        return hashlib.md5(key_data.encode('utf-8')).hexdigest()
+        """生成缓存键（参数按键排序做规范化序列化，避免dict顺序抖动造成伪未命中；xxh3远快于MD5）"""
+        params_bytes = orjson.dumps(retrieval_params, option=orjson.OPT_SORT_KEYS)
+        return xxhash.xxh3_64_hexdigest(query.encode('utf-8') + b'\x00' + params_bytes)
     
     def _is_expired(self, cache_entry: Dict[str, Any]) -> bool:
         """检查缓存是否过期"""
@@ -38,30 +42,30 @@ class QueryCacheManager:
         created_time = cache_entry.get("created_time", 0)
         return time.time() - created_time > self.cache_ttl
     
-    def _cleanup_expired(self):
-        """清理过期缓存"""
-        if not self.cache_enabled:
-            return
-        
-        expired_keys = []
-        for key, entry in self.cache.items():
-            if self._is_expired(entry):
-                expired_keys.append(key)
-        
-        for key in expired_keys:
-            del self.cache[key]
-        
-        if expired_keys:
-            logger.debug(f"清理了 {len(expired_keys)} 个过期缓存条目")
-    
+    def _sweep_expired(self):
+        """弹出过期堆头部并删除实际已过期的条目（摊还O(log N)，不全量扫描）"""
+        now = time.time()
+        swept = 0
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            _, key = heapq.heappop(self._expiry_heap)
+            entry = self.cache.get(key)
+            if entry is not None and self._is_expired(entry):
+                del self.cache[key]
+                swept += 1
+
+        if swept:
+            logger.debug(f"清理了 {swept} 个过期缓存条目")
+
     def _evict_if_needed(self):
-        """如果缓存已满，淘汰最旧的条目"""
+        """如果缓存已满，优先清理过期条目，再淘汰最旧的条目"""
         if not self.cache_enabled:
             return
-        
-        while len(self.cache) >= self.cache_max_size:
-            oldest_key = next(iter(self.cache))
-            del self.cache[oldest_key]
+
+        self._sweep_expired()
+
+        # 每次set最多只需淘汰一个条目；popitem(last=False)单次C调用完成查找+删除
+        if len(self.cache) >= self.cache_max_size:
+            oldest_key, _ = self.cache.popitem(last=False)
             logger.debug(f"缓存已满，淘汰最旧的缓存条目: {oldest_key}")
     
     def get(self, query: str, retrieval_params: Dict[str, Any]) -> Optional[List[Dict]]:
@@ -97,22 +101,25 @@ class QueryCacheManager:
             return
         
         cache_key = self._generate_cache_key(query, retrieval_params)
-        
-        self._cleanup_expired()
+
         self._evict_if_needed()
-        
+
         self.cache[cache_key] = {
             "query": query,
             "params": retrieval_params,
             "results": results,
             "created_time": time.time()
         }
-        
+
+        if self.cache_ttl > 0:
+            heapq.heappush(self._expiry_heap, (time.time() + self.cache_ttl, cache_key))
+
         logger.debug(f"缓存已设置: {query[:50]}...")
     
     def clear(self):
         """清空所有缓存"""
         self.cache.clear()
+        self._expiry_heap.clear()
         self.cache_stats = {
             "hits": 0,
             "misses": 0,
@@ -0,0 +1,112 @@
+import os
+import time
+from typing import Dict, List, Optional, Any
+import numpy as np
+from loguru import logger
+
+
+class SemanticQueryCache:
+    """语义查询缓存管理器
+
+    以查询向量为键缓存完整的回答结果，对语义相近（余弦相似度超过阈值）的
+    重复/改写查询直接返回缓存结果，省掉完整的检索和LLM生成流程。
+    """
+
+    def __init__(self, embeddings):
+        """初始化语义缓存管理器"""
+        self.embeddings = embeddings
+        self.cache_enabled = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+        self.similarity_threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+        self.cache_ttl = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))  # 缓存过期时间（秒）
+        self.cache_max_size = int(os.getenv("SEMANTIC_CACHE_MAX_SIZE", "256"))  # 最大缓存条目数
+
+        # 归一化后的查询向量矩阵（N x dim），与条目列表按行对应
+        self.embedding_matrix: Optional[np.ndarray] = None
+        self.entries: List[Dict[str, Any]] = []
+
+        logger.info(f"语义缓存管理器初始化完成 - 启用: {self.cache_enabled}, 阈值: {self.similarity_threshold}, TTL: {self.cache_ttl}秒")
+
+    def embed_query(self, query: str) -> Optional[np.ndarray]:
+        """计算查询的归一化向量"""
+        if not self.cache_enabled:
+            return None
+
+        try:
+            vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                vector /= norm
+            return vector
+        except Exception as e:
+            logger.error(f"计算查询向量失败: {str(e)}")
+            return None
+
+    def get(self, query_embedding: Optional[np.ndarray]) -> Optional[Dict]:
+        """按向量相似度查找缓存结果"""
+        if not self.cache_enabled or query_embedding is None:
+            return None
+
+        if self.embedding_matrix is None or not self.entries:
+            return None
+
+        # 归一化向量的点积即余弦相似度
+        similarities = self.embedding_matrix @ query_embedding
+        best_idx = int(np.argmax(similarities))
+        best_similarity = float(similarities[best_idx])
+
+        if best_similarity < self.similarity_threshold:
+            return None
+
+        entry = self.entries[best_idx]
+        if self.cache_ttl > 0 and time.time() - entry["created_time"] > self.cache_ttl:
+            self._remove_indices([best_idx])
+            logger.debug(f"语义缓存已过期: {entry['query'][:50]}...")
+            return None
+
+        logger.info(f"语义缓存命中，相似度: {best_similarity:.3f}, 原查询: {entry['query'][:50]}...")
+        return entry["result"]
+
+    def set(self, query: str, query_embedding: Optional[np.ndarray], result: Dict):
+        """缓存查询结果"""
+        if not self.cache_enabled or query_embedding is None:
+            return
+
+        # 缓存已满时淘汰最旧条目
+        if len(self.entries) >= self.cache_max_size:
+            self._remove_indices([0])
+
+        self.entries.append({
+            "query": query,
+            "result": result,
+            "created_time": time.time()
+        })
+
+        row = query_embedding[None, :]
+        if self.embedding_matrix is None:
+            self.embedding_matrix = row
+        else:
+            self.embedding_matrix = np.vstack([self.embedding_matrix, row])
+
+        logger.debug(f"语义缓存已设置: {query[:50]}...")
+
+    def invalidate_by_query(self, query: str):
+        """使特定查询的缓存失效"""
+        indices = [i for i, entry in enumerate(self.entries) if entry["query"] == query]
+        if indices:
+            self._remove_indices(indices)
+            logger.info(f"使 {len(indices)} 个语义缓存条目失效: {query[:50]}...")
+
+    def clear(self):
+        """清空所有缓存"""
+        self.embedding_matrix = None
+        self.entries = []
+        logger.info("语义缓存已清空")
+
+    def _remove_indices(self, indices: List[int]):
+        """按行索引删除缓存条目"""
+        keep = [i for i in range(len(self.entries)) if i not in set(indices)]
+        self.entries = [self.entries[i] for i in keep]
+        if keep and self.embedding_matrix is not None:
+            self.embedding_matrix = self.embedding_matrix[keep]
+        else:
+            self.embedding_matrix = None
@@ -1,37 +1,103 @@
 import os
-import json
+import time
+import queue
+import orjson
 import datetime
+import threading
 from typing import List, Dict, Optional
 from collections import Counter
+import jieba
 import pandas as pd
 from loguru import logger
 
+# 中文常用停用词（高频问题统计时过滤无信息量的功能词）
+_STOPWORDS = frozenset({
+    "的", "了", "是", "我", "你", "他", "她", "它", "我们", "你们", "他们",
+    "这个", "那个", "这些", "那些", "什么", "怎么", "为什么", "可以", "没有",
+    "就是", "还是", "但是", "因为", "所以", "如果", "或者", "以及", "一个",
+    "一下", "不能", "问题", "请问", "谢谢", "您好", "你好"
+})
+
 class FeedbackManager:
     def __init__(self):
         """初始化反馈管理器"""
         self.feedback_dir = os.getenv("FEEDBACK_PATH", "./data/feedback")
         os.makedirs(self.feedback_dir, exist_ok=True)
         
-        # 反馈数据文件
-        self.feedback_file = os.path.join(self.feedback_dir, "feedback.json")
-        
+        # 反馈数据文件（JSON Lines格式：每条反馈一行，追加写入为O(1)）
+        self.feedback_file = os.path.join(self.feedback_dir, "feedback.jsonl")
+
+        # 迁移旧版feedback.json（整文件JSON数组）到JSONL格式
+        legacy_file = os.path.join(self.feedback_dir, "feedback.json")
+        if not os.path.exists(self.feedback_file) and os.path.exists(legacy_file):
+            self._migrate_legacy_file(legacy_file)
+
         # 初始化反馈数据
         if not os.path.exists(self.feedback_file):
-            with open(self.feedback_file, "w", encoding="utf-8") as f:
-                json.dump([], f, ensure_ascii=False, indent=2)
+            open(self.feedback_file, "w", encoding="utf-8").close()
         
         # 高频问题阈值
         self.high_freq_threshold = 3
-        
+
+        # 写锁：反馈接口在线程池中并发执行，串行化读-改-写避免丢失更新
+        self._write_lock = threading.Lock()
+
+        # 后台分析队列：提交接口只负责追加写入，分析流水线移出请求路径
+        self._pending: queue.Queue = queue.Queue()
+        self._analysis_worker = threading.Thread(
+            target=self._run_analysis_worker, name="feedback-analysis", daemon=True
+        )
+        self._analysis_worker.start()
+
         logger.info("反馈管理器初始化完成")
-    
+
+    def _run_analysis_worker(self):
+        """后台分析线程：5秒去抖动合并多条反馈后，对全量数据跑一次分析流水线"""
+        while True:
+            self._pending.get()
+            # 去抖动：短时间内连续提交的反馈合并为一轮分析
+            deadline = time.time() + 5
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    self._pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            try:
+                self.analyze_feedback()
+            except Exception as e:
+                logger.error(f"后台分析反馈失败: {str(e)}")
+
+    def _migrate_legacy_file(self, legacy_file: str):
+        """将旧版JSON数组格式的反馈文件迁移为JSONL"""
+        try:
+            with open(legacy_file, "rb") as f:
+                feedbacks = orjson.loads(f.read())
+
+            with open(self.feedback_file, "wb") as f:
+                for feedback in feedbacks:
+                    f.write(orjson.dumps(feedback) + b"\n")
+
+            os.remove(legacy_file)
+            logger.info(f"已迁移 {len(feedbacks)} 条反馈到JSONL格式")
+        except Exception as e:
+            logger.error(f"迁移反馈文件失败: {str(e)}")
+
+    def _load_feedbacks(self) -> List[Dict]:
+        """加载所有反馈数据"""
+        feedbacks = []
+        with open(self.feedback_file, "rb") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    feedbacks.append(orjson.loads(line))
+        return feedbacks
+
     def add_feedback(self, query_id: str, is_solved: bool, additional_info: str = ""):
         """添加用户反馈"""
         try:
-            # 加载现有反馈
-            with open(self.feedback_file, "r", encoding="utf-8") as f:
-                feedbacks = json.load(f)
-            
             # 添加新反馈
             new_feedback = {
                 "query_id": query_id,
@@ -39,30 +105,32 @@ class FeedbackManager:
                 "additional_info": additional_info,
                 "timestamp": datetime.datetime.now().isoformat()
             }
-            
-            feedbacks.append(new_feedback)
-            
-            # 保存反馈
-            with open(self.feedback_file, "w", encoding="utf-8") as f:
-                json.dump(feedbacks, f, ensure_ascii=False, indent=2)
-            
+
+            # 追加写入单行，无需重写整个文件
+            with self._write_lock:
+                with open(self.feedback_file, "ab") as f:
+                    f.write(orjson.dumps(new_feedback) + b"\n")
+
             logger.info(f"反馈添加成功: {query_id}, 解决状态: {is_solved}")
-            
-            # 分析反馈
-            self.analyze_feedback()
-            
+
+            # 交给后台线程分析，提交接口立即返回
+            self._pending.put(new_feedback)
+
             return True
         except Exception as e:
             logger.error(f"添加反馈失败: {str(e)}")
             return False
     
-    def analyze_feedback(self):
-        """分析用户反馈"""
+    def analyze_feedback(self, feedbacks: Optional[List[Dict]] = None):
+        """分析用户反馈
+
+        整个分析流程只加载一次反馈数据，调用方已持有列表时可直接传入避免重复读盘。
+        """
         try:
-            # 加载反馈数据
-            with open(self.feedback_file, "r", encoding="utf-8") as f:
-                feedbacks = json.load(f)
-            
+            # 加载反馈数据（仅在未传入时读取一次，后续统计/报告复用同一列表）
+            if feedbacks is None:
+                feedbacks = self._load_feedbacks()
+
             if not feedbacks:
                 logger.warning("反馈数据为空")
                 return
@@ -87,13 +155,12 @@ class FeedbackManager:
     def identify_high_freq_issues(self, additional_infos: List[str]):
         """识别高频问题"""
         try:
-            # 简单的关键词提取和统计
-            keywords = []
-            for info in additional_infos:
-                # 简单分词（实际应用中可使用更复杂的NLP工具）
-                words = [w for w in info.split() if len(w) > 1]
-                keywords.extend(words)
-            
+            # jieba中文分词+停用词过滤（按空白切分对中文反馈基本无效）
+            keywords = [
+                w for info in additional_infos for w in jieba.lcut(info)
+                if len(w) > 1 and w not in _STOPWORDS
+            ]
+
             # 统计关键词频率
             keyword_counts = Counter(keywords)
             high_freq_keywords = [k for k, v in keyword_counts.items() if v >= self.high_freq_threshold]
@@ -118,8 +185,8 @@ class FeedbackManager:
             
             # 保存优化建议
             suggestions_file = os.path.join(self.feedback_dir, "optimization_suggestions.json")
-            with open(suggestions_file, "w", encoding="utf-8") as f:
-                json.dump(suggestions, f, ensure_ascii=False, indent=2)
+            with open(suggestions_file, "wb") as f:
+                f.write(orjson.dumps(suggestions, option=orjson.OPT_INDENT_2))
             
             logger.info("优化建议生成完成")
         except Exception as e:
@@ -128,13 +195,13 @@ class FeedbackManager:
     def generate_feedback_report(self, feedbacks: List[Dict]):
         """生成反馈分析报告"""
         try:
-            # 计算解决率
-            total_feedbacks = len(feedbacks)
-            solved_count = sum(1 for f in feedbacks if f.get("is_solved", False))
+            # 单次构建DataFrame，统计全部走向量化归约（避免对列表做多轮Python遍历）
+            df = pd.DataFrame(feedbacks)
+            total_feedbacks = len(df)
+            solved_count = int(df["is_solved"].fillna(False).astype(bool).sum()) if not df.empty else 0
             solved_rate = (solved_count / total_feedbacks * 100) if total_feedbacks > 0 else 0
-            
+
             # 按时间分组分析
-            df = pd.DataFrame(feedbacks)
             if not df.empty:
                 df["date"] = pd.to_datetime(df["timestamp"]).dt.date
                 daily_stats = df.groupby("date").agg(
@@ -157,8 +224,8 @@ class FeedbackManager:
             
             # 保存报告
             report_file = os.path.join(self.feedback_dir, "feedback_report.json")
-            with open(report_file, "w", encoding="utf-8") as f:
-                json.dump(report, f, ensure_ascii=False, indent=2)
+            with open(report_file, "wb") as f:
+                f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
             
             logger.info(f"反馈分析报告生成完成，解决率: {solved_rate:.2f}%")
         except Exception as e:
@@ -167,24 +234,23 @@ class FeedbackManager:
     def get_feedback_stats(self) -> Dict:
         """获取反馈统计信息"""
         try:
-            # 加载反馈数据
-            with open(self.feedback_file, "r", encoding="utf-8") as f:
-                feedbacks = json.load(f)
-            
-            if not feedbacks:
+            # 加载反馈数据（向量化解析JSONL并归约，不做Python循环）
+            df = pd.read_json(self.feedback_file, lines=True)
+
+            if df.empty:
                 return {
                     "total_feedbacks": 0,
                     "solved_count": 0,
                     "solved_rate": 0,
                     "unsolved_count": 0
                 }
-            
+
             # 计算统计信息
-            total_feedbacks = len(feedbacks)
-            solved_count = sum(1 for f in feedbacks if f.get("is_solved", False))
+            total_feedbacks = len(df)
+            solved_count = int(df["is_solved"].fillna(False).astype(bool).sum())
             unsolved_count = total_feedbacks - solved_count
             solved_rate = (solved_count / total_feedbacks * 100) if total_feedbacks > 0 else 0
-            
+
             return {
                 "total_feedbacks": total_feedbacks,
                 "solved_count": solved_count,
@@ -203,8 +269,8 @@ class FeedbackManager:
             if not os.path.exists(suggestions_file):
                 return []
             
-            with open(suggestions_file, "r", encoding="utf-8") as f:
-                suggestions = json.load(f)
+            with open(suggestions_file, "rb") as f:
+                suggestions = orjson.loads(f.read())
             
             return suggestions.get("suggestions", [])
         except Exception as e:
@@ -214,9 +280,9 @@ class FeedbackManager:
     def clear_feedback(self):
         """清空反馈数据"""
         try:
-            with open(self.feedback_file, "w", encoding="utf-8") as f:
-                json.dump([], f, ensure_ascii=False, indent=2)
-            
+            with self._write_lock:
+                open(self.feedback_file, "w", encoding="utf-8").close()
+
             logger.info("反馈数据已清空")
             return True
         except Exception as e:
@@ -226,8 +292,7 @@ class FeedbackManager:
     def get_all_feedbacks(self) -> List[Dict]:
         """获取所有反馈详情"""
         try:
-            with open(self.feedback_file, "r", encoding="utf-8") as f:
-                feedbacks = json.load(f)
+            feedbacks = self._load_feedbacks()
             
             # 按时间倒序排列
             feedbacks.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
@@ -240,8 +305,7 @@ class FeedbackManager:
     def get_feedbacks_by_status(self, is_solved: bool) -> List[Dict]:
         """按解决状态获取反馈"""
         try:
-            with open(self.feedback_file, "r", encoding="utf-8") as f:
-                feedbacks = json.load(f)
+            feedbacks = self._load_feedbacks()
             
             # 过滤指定状态的反馈
             filtered_feedbacks = [f for f in feedbacks if f.get("is_solved", False) == is_solved]
@@ -257,8 +321,7 @@ class FeedbackManager:
     def get_feedback_details(self, limit: int = 50) -> Dict:
         """获取详细的反馈统计信息"""
         try:
-            with open(self.feedback_file, "r", encoding="utf-8") as f:
-                feedbacks = json.load(f)
+            feedbacks = self._load_feedbacks()
             
             if not feedbacks:
                 return {
@@ -1,5 +1,8 @@
 import os
-import json
+import time
+import orjson
+import atexit
+from collections import deque
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta
 from loguru import logger
@@ -16,72 +19,146 @@ class ConversationMemory:
         # 确保存储目录存在
         os.makedirs(os.path.dirname(self.memory_file), exist_ok=True)
         
-        # 加载现有记忆
+        # 合并上下文缓存：session_id -> (版本号, 合并后的字符串)，add_message时失效
+        self._ctx_cache: Dict[str, tuple] = {}
+        self._ctx_versions: Dict[str, int] = {}
+
+        # 组件级缓存：对话上下文按(会话, 条数)、个人信息按会话各自缓存，
+        # 同一轮内的重复调用（代理循环常见）直接命中
+        self._context_cache: Dict[tuple, tuple] = {}
+        self._personal_cache: Dict[str, tuple] = {}
+
+        # 追加日志：每条消息只追加一行，避免每次add_message全量重写JSON；
+        # 启动时回放日志，每N条消息或进程退出时合并回主文件
+        self.log_file = self.memory_file + ".log"
+        self.compact_every = int(os.getenv("MEMORY_COMPACT_EVERY", "100"))
+        self._messages_since_compact = 0
+
+        # 加载现有记忆（主文件+回放日志）
         self.conversations = self._load_memory()
+        self._replay_log()
+
+        atexit.register(self._compact)
+
         logger.info(f"对话记忆管理器初始化完成，加载了 {len(self.conversations)} 个会话")
     
     def _load_memory(self) -> Dict[str, List[Dict]]:
         """加载对话记忆"""
         try:
             if os.path.exists(self.memory_file):
-                with open(self.memory_file, 'r', encoding='utf-8-sig') as f:
-                    return json.load(f)
+                with open(self.memory_file, 'rb') as f:
+                    raw = f.read()
+                # 兼容旧版utf-8-sig写入的BOM前缀
+                if raw.startswith(b'\xef\xbb\xbf'):
+                    raw = raw[3:]
+                data = orjson.loads(raw) if raw else {}
+                # 有界deque：容量满时追加自动弹出最旧消息，免去切片拷贝
+                return {
+                    session_id: deque(messages, maxlen=self.max_history)
+                    for session_id, messages in data.items()
+                }
         except Exception as e:
             logger.error(f"加载对话记忆失败: {str(e)}")
         return {}
     
+    def _replay_log(self):
+        """回放追加日志，恢复上次合并之后写入的消息"""
+        try:
+            if not os.path.exists(self.log_file):
+                return
+
+            with open(self.log_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    record = orjson.loads(line)
+                    session_id = record.pop('session_id')
+                    self.conversations.setdefault(session_id, deque(maxlen=self.max_history)).append(record)
+        except Exception as e:
+            logger.error(f"回放对话记忆日志失败: {str(e)}")
+
+    def _append_log(self, session_id: str, message: Dict):
+        """向追加日志写入单条消息（O(消息大小)，不重写历史）"""
+        try:
+            with open(self.log_file, 'ab') as f:
+                f.write(orjson.dumps({'session_id': session_id, **message}) + b'\n')
+        except Exception as e:
+            logger.error(f"写入对话记忆日志失败: {str(e)}")
+
+    def _compact(self):
+        """合并记忆：全量快照写入主文件并清空追加日志"""
+        try:
+            self._save_memory()
+            open(self.log_file, 'w').close()
+            self._messages_since_compact = 0
+        except Exception as e:
+            logger.error(f"合并对话记忆失败: {str(e)}")
+
     def _save_memory(self):
         """保存对话记忆"""
         try:
             # 清理过期记忆
             self._clean_expired_memory()
-            
+
             # 确保目录存在
             os.makedirs(os.path.dirname(self.memory_file), exist_ok=True)
-            
-            with open(self.memory_file, 'w', encoding='utf-8-sig') as f:
-                json.dump(self.conversations, f, ensure_ascii=False, indent=2, default=str)
+
+            serializable = {session_id: list(messages) for session_id, messages in self.conversations.items()}
+            with open(self.memory_file, 'wb') as f:
+                f.write(orjson.dumps(serializable, option=orjson.OPT_INDENT_2))
         except Exception as e:
             logger.error(f"保存对话记忆失败: {str(e)}")
     
+    @staticmethod
+    def _message_epoch(message: Dict) -> float:
+        """取消息的epoch秒时间戳（兼容旧数据中的ISO字符串格式）"""
+        timestamp = message['timestamp']
+        if isinstance(timestamp, str):
+            return datetime.fromisoformat(timestamp).timestamp()
+        return timestamp
+
+    def _drop_session_caches(self, session_id: str):
+        """清除指定会话的全部派生缓存"""
+        self._ctx_cache.pop(session_id, None)
+        self._ctx_versions.pop(session_id, None)
+        self._personal_cache.pop(session_id, None)
+        for key in [k for k in self._context_cache if k[0] == session_id]:
+            del self._context_cache[key]
+
     def _clean_expired_memory(self):
         """清理过期记忆"""
-        current_time = datetime.now()
-        expired_sessions = []
-        
-        for session_id, messages in self.conversations.items():
-            if not messages:
-                expired_sessions.append(session_id)
-                continue
-            
-            # 检查最后一条消息的时间
-            last_message_time = datetime.fromisoformat(messages[-1]['timestamp'])
-            if (current_time - last_message_time).total_seconds() > self.max_memory_hours * 3600:
-                expired_sessions.append(session_id)
+        cutoff = time.time() - self.max_memory_hours * 3600
+        expired_sessions = [
+            session_id for session_id, messages in self.conversations.items()
+            if not messages or self._message_epoch(messages[-1]) < cutoff
+        ]
         
         for session_id in expired_sessions:
             del self.conversations[session_id]
+            self._drop_session_caches(session_id)
             logger.info(f"清理过期会话: {session_id}")
     
     def add_message(self, session_id: str, role: str, content: str):
         """添加对话消息"""
-        if session_id not in self.conversations:
-            self.conversations[session_id] = []
-        
-        # 添加新消息
+        # 添加新消息（时间戳存epoch秒，过期判断退化为浮点比较）
         message = {
             'role': role,
             'content': content,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': time.time()
         }
-        self.conversations[session_id].append(message)
-        
-        # 保持消息数量在限制内
-        if len(self.conversations[session_id]) > self.max_history:
-            self.conversations[session_id] = self.conversations[session_id][-self.max_history:]
-        
-        # 保存记忆
-        self._save_memory()
+        # 有界deque追加为O(1)，容量满时自动弹出最旧消息
+        self.conversations.setdefault(session_id, deque(maxlen=self.max_history)).append(message)
+
+        # 会话内容变化，递增版本号使合并上下文缓存失效
+        self._ctx_versions[session_id] = self._ctx_versions.get(session_id, 0) + 1
+
+        # 追加写入单条消息；累积到阈值后做一次合并
+        self._append_log(session_id, message)
+        self._messages_since_compact += 1
+        if self._messages_since_compact >= self.compact_every:
+            self._compact()
+
         logger.debug(f"添加消息到会话 {session_id}: {role} - {content[:50]}...")
     
     def get_conversation_history(self, session_id: str, max_messages: Optional[int] = None) -> List[Dict]:
@@ -91,28 +168,40 @@ class ConversationMemory:
         
         history = self.conversations[session_id]
         if max_messages and len(history) > max_messages:
-            return history[-max_messages:]
-        return history
+            return list(history)[-max_messages:]
+        return list(history)
     
     def get_context(self, session_id: str, max_messages: int = 5) -> str:
-        """获取对话上下文"""
+        """获取对话上下文（按会话版本号缓存，消息无变化时直接返回）"""
+        version = self._ctx_versions.get(session_id, 0)
+        cache_key = (session_id, max_messages)
+        cached = self._context_cache.get(cache_key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
         history = self.get_conversation_history(session_id, max_messages)
         if not history:
             return ""
-        
+
         context = "对话历史：\n"
         for message in history:
             role = "用户" if message['role'] == 'user' else "系统"
             context += f"{role}: {message['content']}\n"
-        
+
+        self._context_cache[cache_key] = (version, context)
         return context
     
     def get_personal_info(self, session_id: str) -> str:
-        """获取用户个人信息"""
+        """获取用户个人信息（按会话版本号缓存，免去每轮全量扫描）"""
+        version = self._ctx_versions.get(session_id, 0)
+        cached = self._personal_cache.get(session_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
         history = self.get_conversation_history(session_id)
         if not history:
             return ""
-        
+
         personal_info = "用户个人信息：\n"
         for message in history:
             if message['role'] == 'user':
@@ -120,18 +209,46 @@ class ConversationMemory:
                 # 检查是否包含个人信息
                 if any(keyword in content for keyword in ['名字', '叫什么', '年龄', '多大', '岁']):
                     personal_info += f"{content}\n"
-        
-        return personal_info if personal_info != "用户个人信息：\n" else ""
-    
+
+        result = personal_info if personal_info != "用户个人信息：\n" else ""
+        self._personal_cache[session_id] = (version, result)
+        return result
+
+    def get_full_context(self, session_id: str, max_messages: int = 5) -> str:
+        """获取合并后的完整上下文（个人信息+对话历史）
+
+        长会话每轮重建多KB字符串开销不小，这里按会话版本号缓存合并结果，
+        仅在add_message之后的首次调用重建。
+        """
+        version = self._ctx_versions.get(session_id, 0)
+        cached = self._ctx_cache.get(session_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        conversation_history = self.get_context(session_id, max_messages)
+        personal_info = self.get_personal_info(session_id)
+
+        full_context = conversation_history
+        if personal_info:
+            full_context = personal_info + "\n" + conversation_history
+
+        self._ctx_cache[session_id] = (version, full_context)
+        return full_context
+
     def clear_session(self, session_id: str):
         """清除指定会话的记忆"""
         if session_id in self.conversations:
             del self.conversations[session_id]
-            self._save_memory()
+            self._drop_session_caches(session_id)
+            self._compact()
             logger.info(f"清除会话记忆: {session_id}")
-    
+
     def clear_all(self):
         """清除所有对话记忆"""
         self.conversations = {}
-        self._save_memory()
+        self._ctx_cache.clear()
+        self._ctx_versions.clear()
+        self._context_cache.clear()
+        self._personal_cache.clear()
+        self._compact()
         logger.info("清除所有对话记忆")
@@ -1,3 +1,4 @@
 from .hybrid_retriever import HybridRetriever
+from .reranker import CrossEncoderReranker
 
-__all__ = ["HybridRetriever"]
+__all__ = ["HybridRetriever", "CrossEncoderReranker"]
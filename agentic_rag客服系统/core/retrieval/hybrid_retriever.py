@@ -1,13 +1,21 @@
 import os
 import re
+import jieba
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional, Tuple, Any
-from collections import defaultdict
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from collections import OrderedDict
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.preprocessing import normalize
 import numpy as np
+import joblib
+import xxhash
 from loguru import logger
 from core.cache import QueryCacheManager
 
+# 预热jieba词典：避免首个查询承担词典加载的冷启动延迟
+jieba.initialize()
+
 class HybridRetriever:
     def __init__(self, knowledge_base):
         """初始化混合检索器"""
@@ -17,85 +25,247 @@ class HybridRetriever:
         self.keyword_weight = float(os.getenv("KEYWORD_RETRIEVAL_WEIGHT", "0.4"))
         self.top_k = int(os.getenv("TOP_K", "5"))
         
-        # 初始化TF-IDF向量化器
-        self.tfidf_vectorizer = TfidfVectorizer(
-            token_pattern=r'\b\w+\b',
-            stop_words=None,
+        # 关键词检索后端：bm25（C/NumPy向量化打分，短查询质量更优）或tfidf
+        self.keyword_backend = os.getenv("KEYWORD_BACKEND", "tfidf").lower()
+
+        # 哈希向量化器无状态、可流式逐批转换（无需先收集全量语料建词表），
+        # IDF权重由TfidfTransformer在稀疏计数矩阵上单独拟合。
+        # 中文没有词边界，\b\w+\b会把整段连续汉字当成单个词元，必须用jieba分词
+        self.hashing_vectorizer = HashingVectorizer(
+            n_features=2 ** 20,
+            alternate_sign=False,
+            tokenizer=jieba.lcut,
+            token_pattern=None,
             lowercase=True
         )
-        
-        # 缓存文档内容和TF-IDF矩阵
+        self.tfidf_transformer = TfidfTransformer()
+
+        # 缓存文档内容和TF-IDF矩阵/BM25索引
         self.documents_cache = []
         self.tfidf_matrix = None
+        self.bm25 = None
         
         # 初始化查询结果缓存管理器
         self.query_cache = QueryCacheManager()
-        
-        self._build_keyword_index()
-    
+
+        # 前置LRU缓存：以归一化查询串为键缓存最终结果，热点查询省掉缓存键哈希等开销
+        self.front_cache: OrderedDict[str, List[Dict]] = OrderedDict()
+        self.front_cache_max_size = int(os.getenv("FRONT_CACHE_MAX_SIZE", "1024"))
+
+        # 查询嵌入LRU缓存：重复查询（多跳代理流程常见）跳过整个嵌入模型调用
+        self._embed_cache: OrderedDict[str, List[float]] = OrderedDict()
+        self._embed_cache_max_size = int(os.getenv("EMBED_CACHE_MAX_SIZE", "1024"))
+
+        # 检索线程池：向量检索（网络I/O）与关键词检索（CPU）相互独立，并发执行；
+        # 容量需覆盖并发请求数，避免向量检索在池内排队
+        self._retrieval_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("RETRIEVAL_POOL_SIZE", "8")),
+            thread_name_prefix="retrieval"
+        )
+
+        # 关键词索引磁盘缓存：语料未变化时热启动直接加载，免去O(N)的全量拉取+向量化
+        self.keyword_index_file = os.getenv(
+            "KEYWORD_INDEX_PATH", "./data/vector_db/keyword_index.joblib"
+        )
+
+        if not self._load_keyword_index():
+            self._build_keyword_index()
+            self._save_keyword_index()
+
+    def _collection_count(self) -> Optional[int]:
+        """获取向量集合的文档总数（用作索引缓存的失效判据）"""
+        try:
+            return self.vector_store._collection.count()
+        except Exception as e:
+            logger.warning(f"获取集合文档数失败: {str(e)}")
+            return None
+
+    def _load_keyword_index(self) -> bool:
+        """尝试从磁盘加载关键词索引（仅当集合文档数与缓存时一致）"""
+        try:
+            if self.keyword_backend != "tfidf" or not os.path.exists(self.keyword_index_file):
+                return False
+
+            cached = joblib.load(self.keyword_index_file)
+            count = self._collection_count()
+            if count is None or cached.get("collection_count") != count:
+                return False
+
+            self.tfidf_transformer = cached["tfidf_transformer"]
+            self.tfidf_matrix = cached["tfidf_matrix"]
+            self.documents_cache = cached["documents_cache"]
+            logger.info(f"关键词索引已从磁盘加载，共 {len(self.documents_cache)} 个文档")
+            return True
+        except Exception as e:
+            logger.warning(f"加载关键词索引缓存失败，将重建: {str(e)}")
+            return False
+
+    def _save_keyword_index(self):
+        """将关键词索引持久化到磁盘（BM25后端暂不持久化）"""
+        try:
+            if self.keyword_backend != "tfidf" or self.tfidf_matrix is None:
+                return
+
+            count = self._collection_count()
+            if count is None:
+                return
+
+            os.makedirs(os.path.dirname(self.keyword_index_file), exist_ok=True)
+            joblib.dump({
+                "collection_count": count,
+                "tfidf_transformer": self.tfidf_transformer,
+                "tfidf_matrix": self.tfidf_matrix,
+                "documents_cache": self.documents_cache
+            }, self.keyword_index_file)
+            logger.info("关键词索引已持久化到磁盘")
+        except Exception as e:
+            logger.warning(f"持久化关键词索引失败: {str(e)}")
+
     def _build_keyword_index(self):
-        """构建关键词索引"""
+        """构建关键词索引
+
+        分页拉取集合内容（limit/offset窗口），避免一次get()把全量文档
+        拽进内存；哈希向量化逐批转换，峰值内存只与批大小相关。
+        """
         try:
-            # 获取所有文档
-            documents = self.vector_store.get()
-            if not documents or "documents" not in documents:
+            batch_size = int(os.getenv("KEYWORD_INDEX_BATCH_SIZE", "10000"))
+
+            self.documents_cache = []
+            count_blocks = []
+            corpus_tokens = []
+            offset = 0
+
+            while True:
+                batch = self.vector_store.get(limit=batch_size, offset=offset)
+                docs = batch.get("documents") if batch else None
+                if not docs:
+                    break
+
+                metadatas = batch.get("metadatas") or [{}] * len(docs)
+                texts = []
+                for doc, metadata in zip(docs, metadatas):
+                    content = doc.page_content if hasattr(doc, "page_content") else str(doc)
+                    texts.append(content)
+                    self.documents_cache.append({
+                        "content": content,
+                        "metadata": metadata or {},
+                        "id": len(self.documents_cache)
+                    })
+
+                if self.keyword_backend == "bm25":
+                    corpus_tokens.extend(list(jieba.cut(text)) for text in texts)
+                else:
+                    # 无状态哈希转换，单批稀疏矩阵入列表，不累积原始文本
+                    count_blocks.append(self.hashing_vectorizer.transform(texts))
+
+                offset += len(docs)
+                if len(docs) < batch_size:
+                    break
+
+            if not self.documents_cache:
                 logger.warning("知识库为空，无法构建关键词索引")
                 return
-            
-            # 提取文档内容
-            self.documents_cache = []
-            for i, doc in enumerate(documents["documents"]):
-                content = doc.page_content if hasattr(doc, "page_content") else str(doc)
-                metadata = doc.metadata if hasattr(doc, "metadata") else {}
-                self.documents_cache.append({
-                    "content": content,
-                    "metadata": metadata,
-                    "id": i
-                })
-            
-            # 构建TF-IDF矩阵
-            if self.documents_cache:
-                texts = [doc["content"] for doc in self.documents_cache]
-                self.tfidf_matrix = self.tfidf_vectorizer.fit_transform(texts)
-                logger.info(f"关键词索引构建完成，共 {len(self.documents_cache)} 个文档")
+
+            if self.keyword_backend == "bm25":
+                # BM25索引：jieba分词后一次性建索引，查询打分走NumPy向量化归约
+                import bm25s
+                self.bm25 = bm25s.BM25()
+                self.bm25.index(corpus_tokens)
+            else:
+                # IDF在稀疏计数矩阵上拟合，再做行L2归一化（之后余弦相似度退化为稀疏点积）
+                counts = sparse.vstack(count_blocks) if len(count_blocks) > 1 else count_blocks[0]
+                self.tfidf_matrix = normalize(self.tfidf_transformer.fit_transform(counts), copy=False)
+
+            logger.info(f"关键词索引构建完成（{self.keyword_backend}），共 {len(self.documents_cache)} 个文档")
         except Exception as e:
             logger.error(f"构建关键词索引失败: {str(e)}")
     
+    def _embed_query(self, query: str) -> List[float]:
+        """嵌入查询文本（带LRU缓存，命中时省去一次Ollama HTTP往返）"""
+        cached = self._embed_cache.get(query)
+        if cached is not None:
+            self._embed_cache.move_to_end(query)  # 更新访问顺序
+            return cached
+
+        embedding = self.knowledge_base.embeddings.embed_query(query)
+
+        if len(self._embed_cache) >= self._embed_cache_max_size:
+            self._embed_cache.popitem(last=False)
+        self._embed_cache[query] = embedding
+        return embedding
+
     def vector_retrieval(self, query: str, top_k: int = 5) -> List[Tuple[float, Dict]]:
         """向量检索"""
         try:
-            results = self.vector_store.similarity_search_with_score(query, k=top_k)
-            
+            # 预计算查询向量并直查集合，命中嵌入缓存时只剩HNSW搜索开销
+            query_embedding = self._embed_query(query)
+            results = self.vector_store._collection.query(
+                query_embeddings=[query_embedding],
+                n_results=top_k,
+                include=["documents", "metadatas", "distances"]
+            )
+
             # 转换结果格式
             vector_results = []
-            for doc, score in results:
+            documents = results.get("documents") or [[]]
+            metadatas = results.get("metadatas") or [[]]
+            distances = results.get("distances") or [[]]
+            for content, metadata, distance in zip(documents[0], metadatas[0], distances[0]):
                 # 计算相似度（1 - 距离）
-                similarity = 1.0 - score
+                similarity = 1.0 - distance
                 vector_results.append((similarity, {
-                    "content": doc.page_content,
-                    "metadata": doc.metadata
+                    "content": content,
+                    "metadata": metadata or {}
                 }))
-            
+
             logger.info(f"向量检索完成，找到 {len(vector_results)} 个结果")
             return vector_results
         except Exception as e:
             logger.error(f"向量检索失败: {str(e)}")
             return []
     
+    def _bm25_retrieval(self, query: str, top_k: int) -> List[Tuple[float, Dict]]:
+        """BM25关键词检索"""
+        query_tokens = [list(jieba.cut(query))]
+        indices, scores = self.bm25.retrieve(query_tokens, k=min(top_k, len(self.documents_cache)))
+
+        keyword_results = []
+        for idx, score in zip(indices[0], scores[0]):
+            if score > 0:
+                doc = self.documents_cache[int(idx)]
+                keyword_results.append((float(score), {
+                    "content": doc["content"],
+                    "metadata": doc["metadata"]
+                }))
+        return keyword_results
+
     def keyword_retrieval(self, query: str, top_k: int = 5) -> List[Tuple[float, Dict]]:
         """关键词检索"""
         try:
-            if not self.documents_cache or self.tfidf_matrix is None:
+            if not self.documents_cache:
                 return []
-            
-            # 处理查询
-            query_vector = self.tfidf_vectorizer.transform([query])
-            
-            # 计算相似度
-            similarities = cosine_similarity(query_vector, self.tfidf_matrix)[0]
-            
-            # 获取top_k结果
-            top_indices = similarities.argsort()[-top_k:][::-1]
+
+            if self.bm25 is not None:
+                keyword_results = self._bm25_retrieval(query, top_k)
+                logger.info(f"关键词检索完成，找到 {len(keyword_results)} 个结果")
+                return keyword_results
+
+            if self.tfidf_matrix is None:
+                return []
+
+            # 处理查询（行已归一化，余弦相似度=稀疏矩阵点积，不再经过cosine_similarity的稠密转换）
+            query_vector = normalize(
+                self.tfidf_transformer.transform(self.hashing_vectorizer.transform([query])),
+                copy=False
+            )
+            similarities = (self.tfidf_matrix @ query_vector.T).toarray().ravel()
+
+            # 获取top_k结果：argpartition线性选出前K，再只对K个元素排序（O(N)代替O(N log N)）
+            if top_k < similarities.size:
+                top_indices = np.argpartition(-similarities, top_k)[:top_k]
+                top_indices = top_indices[np.argsort(-similarities[top_indices])]
+            else:
+                top_indices = np.argsort(-similarities)
             keyword_results = []
             
             for idx in top_indices:
@@ -126,38 +296,45 @@ class HybridRetriever:
             if cached_results is not None:
                 return cached_results
             
-            # 执行两种检索
-            vector_results = self.vector_retrieval(query, top_k * 2)
+            # 并发执行两种检索：向量检索的网络等待与关键词检索的CPU计算重叠，
+            # 混合检索耗时≈max(两者)而非两者之和
+            vector_future = self._retrieval_executor.submit(self.vector_retrieval, query, top_k * 2)
             keyword_results = self.keyword_retrieval(query, top_k * 2)
+            vector_results = vector_future.result()
             
-            # 融合结果
-            combined_results = defaultdict(float)
-            result_metadata = {}
-            
-            # 添加向量检索结果
-            for similarity, result in vector_results:
-                content_hash = hash(result["content"])
-                combined_results[content_hash] += similarity * self.vector_weight
-                result_metadata[content_hash] = result
-            
-            # 添加关键词检索结果
-            for similarity, result in keyword_results:
-                content_hash = hash(result["content"])
-                combined_results[content_hash] += similarity * self.keyword_weight
-                if content_hash not in result_metadata:
-                    result_metadata[content_hash] = result
-            
-            # 排序并返回top_k结果
-            sorted_results = sorted(
-                combined_results.items(),
-                key=lambda x: x[1],
-                reverse=True
-            )[:top_k]
-            
+            # 融合结果：先按(来源, 块序号)键建立候选索引（见_result_key），
+            # 两路得分落入float32数组，加权融合为单次向量化乘加
+            key_index = {}
+            candidates = []
+            vector_scored = [(self._result_key(result), similarity, result) for similarity, result in vector_results]
+            keyword_scored = [(self._result_key(result), similarity, result) for similarity, result in keyword_results]
+
+            for result_key, _, result in vector_scored + keyword_scored:
+                if result_key not in key_index:
+                    key_index[result_key] = len(candidates)
+                    candidates.append(result)
+
+            vector_scores = np.zeros(len(candidates), np.float32)
+            keyword_scores = np.zeros(len(candidates), np.float32)
+            for result_key, similarity, _ in vector_scored:
+                vector_scores[key_index[result_key]] += similarity
+            for result_key, similarity, _ in keyword_scored:
+                keyword_scores[key_index[result_key]] += similarity
+
+            scores = np.float32(self.vector_weight) * vector_scores + np.float32(self.keyword_weight) * keyword_scores
+
+            # 取top_k结果：argpartition线性选出前K再局部排序
+            k = min(top_k, scores.size)
+            if k < scores.size:
+                top_indices = np.argpartition(-scores, k)[:k]
+                top_indices = top_indices[np.argsort(-scores[top_indices])]
+            else:
+                top_indices = np.argsort(-scores)
+
             final_results = []
-            for content_hash, score in sorted_results:
-                result = result_metadata[content_hash]
-                result["score"] = score
+            for idx in top_indices:
+                result = candidates[idx]
+                result["score"] = float(scores[idx])
                 final_results.append(result)
             
             # 将结果存入缓存
@@ -169,13 +346,53 @@ class HybridRetriever:
             logger.error(f"混合检索失败: {str(e)}")
             return []
     
+    @staticmethod
+    def _result_key(result: Dict):
+        """生成检索结果的去重键
+
+        优先用(来源, 块序号)元组——哈希为O(1)且语义上唯一标识一个块；
+        元数据不完整时退回内容的xxh3指纹（确定性SIMD哈希，长文本上比
+        内置SipHash快数倍，且不随进程重启变化）。
+        """
+        metadata = result["metadata"]
+        source = metadata.get("source")
+        chunk_index = metadata.get("chunk_index")
+        if source is not None and chunk_index is not None:
+            return (source, chunk_index)
+        return xxhash.xxh3_64_intdigest(result["content"].encode("utf-8"))
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """归一化查询串（去首尾空白、转小写、压缩连续空白）"""
+        return re.sub(r'\s+', ' ', query.strip().lower())
+
     def get_relevant_documents(self, query: str) -> List[Dict]:
-        """获取相关文档"""
-        return self.hybrid_retrieval(query, self.top_k)
+        """获取相关文档（带前置LRU缓存）"""
+        cache_key = self._normalize_query(query)
+
+        cached = self.front_cache.get(cache_key)
+        if cached is not None:
+            self.front_cache.move_to_end(cache_key)  # 更新访问顺序
+            return cached
+
+        results = self.hybrid_retrieval(query, self.top_k)
+
+        # 缓存已满时淘汰最久未访问的条目
+        if len(self.front_cache) >= self.front_cache_max_size:
+            self.front_cache.popitem(last=False)
+        self.front_cache[cache_key] = results
+
+        return results
     
     def update_keyword_index(self):
-        """更新关键词索引"""
+        """更新关键词索引（强制重建并刷新磁盘缓存）"""
+        try:
+            if os.path.exists(self.keyword_index_file):
+                os.remove(self.keyword_index_file)
+        except Exception as e:
+            logger.warning(f"删除关键词索引缓存失败: {str(e)}")
         self._build_keyword_index()
+        self._save_keyword_index()
     
     def adjust_retrieval_weights(self, vector_weight: float, keyword_weight: float):
         """调整检索权重"""
@@ -190,9 +407,11 @@ class HybridRetriever:
     def clear_cache(self):
         """清空查询结果缓存"""
         self.query_cache.clear()
+        self.front_cache.clear()
         logger.info("查询结果缓存已清空")
-    
+
     def invalidate_cache_by_query(self, query: str):
         """使特定查询的缓存失效"""
         self.query_cache.invalidate_by_query(query)
+        self.front_cache.pop(self._normalize_query(query), None)
         logger.info(f"查询 '{query[:50]}...' 的缓存已失效")
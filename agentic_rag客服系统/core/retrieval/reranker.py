@@ -0,0 +1,100 @@
+import os
+import time
+import xxhash
+from typing import Dict, List, Tuple
+from collections import OrderedDict
+from loguru import logger
+
+
+class CrossEncoderReranker:
+    """交叉编码器重排序器
+
+    对混合检索的候选结果做精排，只把得分最高的前K条送入提示词，
+    既提升相关性又缩短提示词长度。模型加载较重，默认关闭，
+    通过RERANKER_ENABLED=true开启。
+    """
+
+    def __init__(self):
+        """初始化重排序器"""
+        self.enabled = os.getenv("RERANKER_ENABLED", "false").lower() == "true"
+        self.model_name = os.getenv("RERANKER_MODEL", "BAAI/bge-reranker-v2-m3")
+        self.top_k = int(os.getenv("RERANKER_TOP_K", "5"))
+        self.score_cache_ttl = int(os.getenv("RERANKER_CACHE_TTL", "900"))  # 秒，默认15分钟
+        self.score_cache_max_size = int(os.getenv("RERANKER_CACHE_MAX_SIZE", "4096"))
+
+        # 模型延迟加载：未开启或未用到时不占用内存
+        self._model = None
+
+        # 得分LRU缓存：xxh3(query + doc) -> (得分, 过期时间)，重复查询直接短路；
+        # 容量有界+过期清扫，长时间运行不随查询多样性无限增长
+        self._score_cache: OrderedDict[str, Tuple[float, float]] = OrderedDict()
+
+        if self.enabled:
+            logger.info(f"交叉编码器重排序器已启用 - 模型: {self.model_name}, top_k: {self.top_k}")
+
+    def _get_model(self):
+        """延迟加载CrossEncoder模型"""
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+            self._model = CrossEncoder(self.model_name)
+            logger.info(f"重排序模型加载完成: {self.model_name}")
+        return self._model
+
+    @staticmethod
+    def _cache_key(query: str, content: str) -> str:
+        """生成查询-文档对的缓存键"""
+        return xxhash.xxh3_64_hexdigest(query.encode("utf-8") + b"\x00" + content.encode("utf-8"))
+
+    def _sweep_expired(self, now: float):
+        """清除已过期的得分缓存条目"""
+        expired = [key for key, (_, expiry) in self._score_cache.items() if expiry <= now]
+        for key in expired:
+            del self._score_cache[key]
+
+    def rerank(self, query: str, docs: List[Dict]) -> List[Dict]:
+        """对检索结果按交叉编码器得分重排序并截取前K条
+
+        未开启或候选数不超过top_k时原样返回，不加载模型。
+        精确短语命中（查询整体出现在文档中）的文档直接保留，绕过模型打分。
+        """
+        if not self.enabled or len(docs) <= self.top_k:
+            return docs
+
+        try:
+            now = time.time()
+            self._sweep_expired(now)
+
+            scores: List[float] = [0.0] * len(docs)
+            to_score = []  # (索引, 缓存键)
+
+            for i, doc in enumerate(docs):
+                content = doc["content"]
+                # 精确短语命中无需模型判断相关性
+                if query in content:
+                    scores[i] = float("inf")
+                    continue
+
+                key = self._cache_key(query, content)
+                cached = self._score_cache.get(key)
+                if cached is not None and cached[1] > now:
+                    scores[i] = cached[0]
+                    self._score_cache.move_to_end(key)  # 更新访问顺序
+                else:
+                    to_score.append((i, key))
+
+            if to_score:
+                model = self._get_model()
+                pairs = [(query, docs[i]["content"]) for i, _ in to_score]
+                predicted = model.predict(pairs)
+                expiry = now + self.score_cache_ttl
+                for (i, key), score in zip(to_score, predicted):
+                    scores[i] = float(score)
+                    if len(self._score_cache) >= self.score_cache_max_size:
+                        self._score_cache.popitem(last=False)
+                    self._score_cache[key] = (float(score), expiry)
+
+            ranked = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+            return [docs[i] for i in ranked[:self.top_k]]
+        except Exception as e:
+            logger.error(f"重排序失败，回退原始顺序: {str(e)}")
+            return docs